@@ -1,8 +1,24 @@
 import streamlit as st
 import ee
 import geemap.foliumap as geemap
+import geopandas as gpd
+import rasterio
+import rasterio.features
+import rasterio.merge
+import rasterio.windows
+import requests
+from google.cloud import storage
+import numpy as np
+import io
 import os
+import hashlib
+import math
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+import shapely
+from shapely.geometry import mapping, shape
 
 # --- Page Configuration ---
 st.set_page_config(layout="wide", page_title="AgriBoundary: Field Detector")
@@ -36,75 +52,180 @@ st.markdown("""
     1. Upload a KML file containing your Area of Interest (AOI).<br>
     2. The app fetches Sentinel-2 satellite imagery for that area.<br>
     3. It applies the SNIC segmentation algorithm to detect field boundaries.<br>
-    4. You can download the resulting boundaries as a KML file.
+    4. You can download the resulting boundaries as FlatGeobuf (compact, fast to open in GIS tools) or KML.
 </div>
 """, unsafe_allow_html=True)
 
 # --- GEE Initialization ---
+# High-volume endpoint: separate quota, built for many parallel tile/export requests
+GEE_API_URL = 'https://earthengine-highvolume.googleapis.com'
+
+@st.cache_resource(show_spinner=False)
 def initialize_gee():
+    """Initializes Earth Engine, authenticating first if needed.
+
+    Raises on failure; exceptions aren't cached, so the next run retries.
+    UI messages live at the call site because cached functions replay them.
+    """
     try:
-        ee.Initialize()
-        return True
-    except Exception as e:
-        st.warning("GEE not initialized. Trying to authenticate...")
-        try:
-            ee.Authenticate()
-            ee.Initialize()
-            return True
-        except Exception as e2:
-            st.error(f"Authentication failed: {e2}")
-            st.info("Please run `earthengine authenticate` in your terminal first.")
-            return False
-
-if not initialize_gee():
+        ee.Initialize(opt_url=GEE_API_URL)
+    except Exception:
+        ee.Authenticate()
+        ee.Initialize(opt_url=GEE_API_URL)
+
+# Initialization is process-wide, so it only runs on the first script run
+try:
+    initialize_gee()
+except Exception as e:
+    st.error(f"Authentication failed: {e}")
+    st.info("Please run `earthengine authenticate` in your terminal first.")
     st.stop()
 
 # --- Sidebar Controls ---
 with st.sidebar:
-    st.header("⚙️ Parameters")
+    # Parameters are applied together on submit, so dragging a slider doesn't rerun GEE work
+    with st.form("parameters"):
+        st.header("⚙️ Parameters")
+    
+        # Date Range
+        start_date = st.date_input("Start Date", value=date(2023, 5, 1))
+        end_date = st.date_input("End Date", value=date(2023, 9, 30))
+    
+        # Cloud Filter
+        cloud_pct = st.slider("Max Cloud Cover %", 0, 30, 10)
+        max_cloud_prob = st.slider("Max Cloud Probability %", 0, 100, 60, help="Pixels above this s2cloudless probability are masked")
+    
+        # Map preview (median is only computed for segmentation)
+        preview_mode = st.radio("Preview compositing", ["first", "mosaic", "median"], index=1,
+                                horizontal=True, help="first/mosaic are much faster to render than median")
+    
+        # Segmentation Parameters (SNIC)
+        st.subheader("Segmentation Tuning")
+        seed_grid_size = st.slider("Grid/Seed Size (Pixels)", 10, 100, 30, help="Smaller = smaller fields, Larger = larger fields")
+        compactness = st.slider("Compactness", 0.0, 2.0, 0.5, help="Shape vs Color importance")
     
-    # Date Range
-    start_date = st.date_input("Start Date", value=import_datetime_date(2023, 5, 1))
-    end_date = st.date_input("End Date", value=import_datetime_date(2023, 9, 30))
+        # Materialized composites
+        st.subheader("Caching")
+        asset_folder = st.text_input("EE asset folder (optional)", "", placeholder="users/<you>/agriboundary",
+                                     help="Save each composite as an Earth Engine asset so map tiles are read instead of recomputed")
     
-    # Cloud Filter
-    cloud_pct = st.slider("Max Cloud Cover %", 0, 30, 10)
+        gcs_bucket = st.text_input("GCS bucket (optional)", "",
+                                   help="Export the cluster raster as a COG to this bucket instead of downloading it synchronously")
     
-    # Segmentation Parameters (SNIC)
-    st.subheader("Segmentation Tuning")
-    seed_grid_size = st.slider("Grid/Seed Size (Pixels)", 10, 100, 30, help="Smaller = smaller fields, Larger = larger fields")
-    compactness = st.slider("Compactness", 0.0, 2.0, 0.5, help="Shape vs Color importance")
+        st.form_submit_button("Apply", width="stretch")
     
     st.divider()
     st.caption("Powered by Google Earth Engine & Streamlit")
 
 # --- Helper Functions ---
 
-def get_sentinel_image(geometry, start, end, cloud_max):
-    """Fetches and masks Sentinel-2 imagery."""
-    def mask_s2_clouds(image):
-        qa = image.select('QA60')
-        cloud_bit_mask = 1 << 10
-        cirrus_bit_mask = 1 << 11
-        mask = qa.bitwiseAnd(cloud_bit_mask).eq(0).And(
-            qa.bitwiseAnd(cirrus_bit_mask).eq(0))
-        return image.updateMask(mask).divide(10000)
-
-    dataset = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
+def get_sentinel_image(geometry, start, end, cloud_max, max_cloud_prob):
+    """Fetches and masks Sentinel-2 imagery.
+
+    Returns the filtered collection and its median composite.
+    """
+    s2_sr = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
         .filterDate(str(start), str(end)) \
         .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', cloud_max)) \
-        .filterBounds(geometry) \
-        .map(mask_s2_clouds)
+        .filterBounds(geometry)
+    s2_clouds = ee.ImageCollection('COPERNICUS/S2_CLOUD_PROBABILITY') \
+        .filterDate(str(start), str(end)) \
+        .filterBounds(geometry)
+
+    # Attach the matching s2cloudless probability image to each SR scene
+    joined = ee.Join.saveFirst('cloud_mask').apply(
+        primary=s2_sr,
+        secondary=s2_clouds,
+        condition=ee.Filter.equals(leftField='system:index', rightField='system:index')
+    )
+
+    def mask_clouds(image):
+        image = ee.Image(image)
+        clouds = ee.Image(image.get('cloud_mask')).select('probability')
+        is_clear = clouds.lt(max_cloud_prob)
+        # Reflectance stays in native uint16 units (x10000) to keep exports half the size of float32
+        return image.updateMask(is_clear)
+
+    dataset = ee.ImageCollection(joined) \
+        .map(mask_clouds) \
+        .sort('CLOUDY_PIXEL_PERCENTAGE')
     
-    # Return the median composite to minimize clouds/artifacts
+    # Median composite to minimize clouds/artifacts (used for segmentation only)
+    return dataset, dataset.median().toUint16().clip(geometry)
+
+def preview_image(dataset, geometry, mode):
+    """Builds a cheap composite for map display."""
+    if mode == 'first':
+        return dataset.first().clip(geometry)
+    if mode == 'mosaic':
+        # mosaic() paints the last image on top, so put the clearest scene last
+        return dataset.sort('CLOUDY_PIXEL_PERCENTAGE', False).mosaic().clip(geometry)
     return dataset.median().clip(geometry)
 
-def detect_boundaries(image, geometry, size, compact):
+# Longest a script run blocks on a batch export (it keeps running on GEE afterwards)
+EXPORT_TIMEOUT_S = 30 * 60
+
+def wait_for_task(task, label):
+    """Starts a batch export and polls it inside an st.status widget.
+
+    If an export with the same description is already queued or running
+    (e.g. started by a run that was interrupted), that one is polled instead.
+    """
+    description = task.config['description']
+    running = [
+        t for t in ee.batch.Task.list()
+        if t.config.get('description') == description
+        and t.state in (ee.batch.Task.State.READY, ee.batch.Task.State.RUNNING)
+    ]
+    if running:
+        task = running[0]
+    else:
+        task.start()
+
+    deadline = time.monotonic() + EXPORT_TIMEOUT_S
+    with st.status(label) as status:
+        while task.active():
+            if time.monotonic() > deadline:
+                status.update(label="Export still running", state="error")
+                raise TimeoutError(f"Export '{description}' did not finish within {EXPORT_TIMEOUT_S // 60} minutes; "
+                                   "rerun later to pick it up")
+            time.sleep(5)
+        state = task.status()
+        if state['state'] != 'COMPLETED':
+            status.update(label="Export failed", state="error")
+            raise RuntimeError(state.get('error_message', state['state']))
+        status.update(label="Export complete", state="complete")
+
+def tile_url(image, vis_params):
+    """Returns the XYZ tile URL template for a visualized EE image."""
+    return image.getMapId(vis_params)['tile_fetcher'].url_format
+
+def materialize_image(image, geometry, asset_id):
+    """Exports an image to an EE asset once and returns the stored copy."""
+    try:
+        exists = ee.data.getInfo(asset_id) is not None
+    except ee.EEException:
+        exists = False
+
+    if not exists:
+        task = ee.batch.Export.image.toAsset(
+            image=image,
+            description='agriboundary_' + asset_id.rsplit('/', 1)[-1],
+            assetId=asset_id,
+            region=geometry,
+            scale=10,
+            maxPixels=1e10
+        )
+        wait_for_task(task, "Saving composite to Earth Engine asset...")
+
+    return ee.Image(asset_id)
+
+def detect_boundaries(image, size, compact):
     """Applies SNIC segmentation to detect boundaries."""
     
     # Select bands for segmentation (Visible + NIR usually best for fields)
     bands = ['B2', 'B3', 'B4', 'B8']
-    input_image = image.select(bands)
+    input_image = image.select(bands).divide(10000)
     
     # Create seeds
     seeds = ee.Algorithms.Image.Segmentation.seedGrid(size)
@@ -118,18 +239,207 @@ def detect_boundaries(image, geometry, size, compact):
         seeds=seeds
     )
     
-    clusters = snic.select('clusters')
-    
-    # Vectorize the clusters (Raster -> Vector)
-    vectors = clusters.reduceToVectors(
-        geometry=geometry,
-        scale=10, # Sentinel-2 resolution
-        geometryType='polygon',
-        eightConnected=False,
-        labelProperty='cluster_id'
-    )
-    
-    return vectors, snic.select(bands).reproject(crs=snic.projection(), scale=10)
+    return snic.select('clusters')
+
+# Cap on the cluster raster edge pulled from GEE (also keeps it under the download limit)
+MAX_EXPORT_PX = 2048
+# Batch exports to GCS have no download limit and are read in windows, so allow a larger raster
+MAX_GCS_EXPORT_PX = 8192
+
+def export_scale(bounds, max_px=MAX_EXPORT_PX):
+    """Picks the finest scale (>= 10 m) that keeps the AOI bounding box within max_px."""
+    min_x, min_y, max_x, max_y = bounds
+    return max(10, math.ceil(max(max_x - min_x, max_y - min_y) / max_px))
+
+# Edge length (pixels) of each cluster tile downloaded from GEE
+EXPORT_TILE_PX = 1024
+
+def export_tile(image, crs, crs_transform, tile_bounds, tif_path):
+    """Downloads one grid-aligned tile of an image, raising with GEE's message on failure."""
+    url = image.getDownloadURL({
+        'format': 'GEO_TIFF',
+        'crs': crs,
+        'crs_transform': crs_transform,
+        'region': ee.Geometry.Rectangle(list(tile_bounds), proj=crs, geodesic=False),
+    })
+    response = requests.get(url, timeout=300)
+    if not response.ok:
+        raise RuntimeError(f"Tile download failed ({response.status_code}): {response.text}")
+    with open(tif_path, 'wb') as f:
+        f.write(response.content)
+    return tif_path
+
+def download_clusters(image, crs, crs_transform, footprint, scale):
+    """Downloads the cluster raster synchronously, fetching all tiles in parallel."""
+    min_x, min_y, max_x, max_y = footprint.bounds
+    step = EXPORT_TILE_PX * scale
+    # Only fetch grid tiles that touch the AOI (multipart AOIs leave most of the box empty)
+    tiles = [
+        tile
+        for tile in (
+            (x, max(y - step, min_y), min(x + step, max_x), y)
+            for x in np.arange(min_x, max_x, step)
+            for y in np.arange(max_y, min_y, -step)
+        )
+        if shapely.box(*tile).intersects(footprint)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # At most (MAX_EXPORT_PX / EXPORT_TILE_PX)² tiles, so one thread per tile
+        with ThreadPoolExecutor(max_workers=len(tiles)) as executor:
+            tif_paths = list(executor.map(
+                lambda i_tile: export_tile(image, crs, crs_transform, i_tile[1],
+                                           os.path.join(tmp_dir, f'clusters_{i_tile[0]}.tif')),
+                enumerate(tiles)
+            ))
+
+        sources = [rasterio.open(path) for path in tif_paths]
+        try:
+            mosaic, transform = rasterio.merge.merge(sources, nodata=-1)
+        finally:
+            for src in sources:
+                src.close()
+
+    return mosaic[0], transform
+
+def cluster_grid(clusters, footprint, scale):
+    """Prepares the cluster raster for export and its shared pixel grid."""
+    # Masked pixels (outside the AOI / clouds) are written as -1
+    image = clusters.unmask(-1).toInt32()
+    # All tiles share one pixel grid anchored at the AOI's upper-left corner
+    min_x, min_y, max_x, max_y = footprint.bounds
+    return image, [scale, 0, min_x, 0, -scale, max_y]
+
+def export_clusters_gcs(clusters, crs, footprint, scale, bucket, name):
+    """Exports the cluster raster to GCS as a COG unless it is already there.
+
+    Polls the export in an st.status widget, so it must not run inside a
+    cached function (cache hits would replay the 'running' status).
+    """
+    # Large exports are split into name-XXXXXXXXXX-XXXXXXXXXX.tif shards
+    if not any(blob.name.endswith('.tif') for blob in storage.Client().list_blobs(bucket, prefix=name)):
+        image, crs_transform = cluster_grid(clusters, footprint, scale)
+        task = ee.batch.Export.image.toCloudStorage(
+            image=image,
+            description='agriboundary_' + name,
+            bucket=bucket,
+            fileNamePrefix=name,
+            region=ee.Geometry.Rectangle(list(footprint.bounds), proj=crs, geodesic=False),
+            crs=crs,
+            crsTransform=crs_transform,
+            maxPixels=1e10,
+            fileFormat='GeoTIFF',
+            formatOptions={'cloudOptimized': True}
+        )
+        wait_for_task(task, "Exporting clusters to Cloud Storage...")
+
+def read_clusters_gcs(bucket, name):
+    """Reads an exported cluster COG back from GCS in windows.
+
+    Yields (data, transform) per EXPORT_TILE_PX window of every shard, so only
+    one window is held in memory. Shards are fetched with the
+    google-cloud-storage client (same application default credentials as the
+    existence check); GDAL's /vsigs/ would need its own GCS credentials.
+    """
+    blobs = [blob for blob in storage.Client().list_blobs(bucket, prefix=name) if blob.name.endswith('.tif')]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i, blob in enumerate(blobs):
+            tif_path = os.path.join(tmp_dir, f'shard_{i}.tif')
+            blob.download_to_filename(tif_path)
+            with rasterio.open(tif_path) as src:
+                for row in range(0, src.height, EXPORT_TILE_PX):
+                    for col in range(0, src.width, EXPORT_TILE_PX):
+                        window = rasterio.windows.Window(col, row,
+                                                         min(EXPORT_TILE_PX, src.width - col),
+                                                         min(EXPORT_TILE_PX, src.height - row))
+                        yield src.read(1, window=window), src.window_transform(window)
+            os.unlink(tif_path)
+
+def polygonize_clusters(clusters, crs, footprint, scale=10, bucket=None, name=None):
+    """Fetches the SNIC cluster raster from GEE and vectorizes it locally.
+
+    Reads a finished Cloud Storage export when a bucket is given (see
+    export_clusters_gcs), otherwise downloads synchronously in tiles.
+    """
+    if bucket:
+        chunks = read_clusters_gcs(bucket, name)
+    else:
+        image, crs_transform = cluster_grid(clusters, footprint, scale)
+        chunks = [download_clusters(image, crs, crs_transform, footprint, scale)]
+
+    records = [
+        {'geometry': shape(geom), 'cluster_id': int(value)}
+        for data, transform in chunks
+        for geom, value in rasterio.features.shapes(
+            data, mask=data >= 0, transform=transform, connectivity=4)
+    ]
+
+    if not records:
+        return gpd.GeoDataFrame({'cluster_id': []}, geometry=[], crs='EPSG:4326')
+
+    # Dissolving by cluster id also joins polygons split at tile/window seams
+    gdf = gpd.GeoDataFrame(records, crs=crs).dissolve(by='cluster_id', as_index=False)
+    return gdf.to_crs('EPSG:4326')
+
+# Results cached per process (shared across sessions); bounded so memory doesn't grow unchecked
+CACHE_ENTRIES = 16
+
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def build_boundaries(boundary_key, _clusters, crs, _footprint, scale, bucket, name):
+    """Vectorizes the SNIC clusters.
+
+    `boundary_key` identifies the AOI, imagery, SNIC parameters and scale behind
+    `_clusters` (an EE object) and `_footprint` (a shapely geometry), which
+    st.cache_data can't hash. Must not create Streamlit elements: they
+    would be replayed on every cache hit.
+    """
+    return polygonize_clusters(_clusters, crs, _footprint, scale, bucket=bucket, name=name)
+
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def vector_bytes(boundary_key, _gdf, driver):
+    """Writes the boundaries for `boundary_key` to an in-memory file in the given OGR format."""
+    buffer = io.BytesIO()
+    _gdf.to_file(buffer, driver=driver, engine='pyogrio')
+    return buffer.getvalue()
+
+def session_cached(name, key, compute):
+    """Returns st.session_state[name][key], computing and storing it on first use.
+
+    For EE handles, which st.cache_data can't hash; the oldest entries are
+    dropped beyond CACHE_ENTRIES.
+    """
+    cache = st.session_state.setdefault(name, {})
+    if key not in cache:
+        cache[key] = compute()
+        while len(cache) > CACHE_ENTRIES:
+            del cache[next(iter(cache))]
+    return cache[key]
+
+# AOI simplification tolerance in degrees (~10 m, one Sentinel-2 pixel)
+AOI_SIMPLIFY_TOLERANCE = 1e-4
+
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def parse_aoi(kml_bytes):
+    """Reads an AOI KML with the vectorized OGR reader.
+
+    Returns the simplified AOI as GeoJSON, its UTM CRS, the AOI in UTM
+    coordinates and the vertex counts before/after simplification.
+    """
+    # Save uploaded KML to a temp file so GDAL can read it
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.kml') as tmp_file:
+        tmp_file.write(kml_bytes)
+        tmp_path = tmp_file.name
+    try:
+        gdf = gpd.read_file(tmp_path, engine="pyogrio").to_crs(4326)
+    finally:
+        os.unlink(tmp_path)
+    # Dissolve all features into one (multi)polygon, keeping holes; EE wants 2D coordinates
+    aoi_geom = shapely.force_2d(shapely.union_all(gdf.geometry.values))
+    # Fewer vertices = smaller request payloads and cheaper filterBounds on every GEE call
+    simplified = aoi_geom.simplify(AOI_SIMPLIFY_TOLERANCE, preserve_topology=True)
+    vertex_counts = (len(shapely.get_coordinates(aoi_geom)), len(shapely.get_coordinates(simplified)))
+    gdf_utm = gdf.to_crs(gdf.estimate_utm_crs())
+    return mapping(simplified), gdf_utm.crs.to_string(), shapely.union_all(gdf_utm.geometry.values), vertex_counts
 
 # --- Main Logic ---
 
@@ -141,40 +451,61 @@ m.add_basemap("HYBRID")
 
 if uploaded_file is not None:
     try:
-        # Save uploaded KML to a temp file so geemap can read it
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.kml') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_path = tmp_file.name
+        aoi_hash = hashlib.md5(uploaded_file.getvalue()).hexdigest()
+
+        # Parse the KML once per upload (cached on its bytes)
+        aoi_geojson, aoi_utm_crs, aoi_utm, aoi_vertices = parse_aoi(uploaded_file.getvalue())
+        st.caption(f"AOI simplified from {aoi_vertices[0]} to {aoi_vertices[1]} vertices")
 
         # Convert KML to EE Geometry
-        # Note: geemap uses internal logic to parse KML. If complex, might need fiona.
-        # We assume simple polygon KML here.
-        aoi_ee = geemap.kml_to_ee(tmp_path)
-        
-        # If aoi_ee is a FeatureCollection, get the geometry union
-        if isinstance(aoi_ee, ee.FeatureCollection):
-            aoi_geometry = aoi_ee.geometry()
-        else:
-            aoi_geometry = aoi_ee
+        aoi_geometry = ee.Geometry(aoi_geojson)
 
         # Center Map
         m.centerObject(aoi_geometry, 13)
         
         with st.spinner('Processing Satellite Imagery...'):
-            # 1. Get Imagery
-            s2_image = get_sentinel_image(aoi_geometry, start_date, end_date, cloud_pct)
+            # 1. Get Imagery (reuse the composite across reruns with the same inputs)
+            composite_key = (aoi_hash, str(start_date), str(end_date), cloud_pct, max_cloud_prob)
+            s2_collection, s2_image = session_cached('composites', composite_key, lambda: get_sentinel_image(
+                aoi_geometry, start_date, end_date, cloud_pct, max_cloud_prob))
             
-            # Display True Color Image
-            vis_params = {'min': 0.0, 'max': 0.3, 'bands': ['B4', 'B3', 'B2']}
-            m.addLayer(s2_image, vis_params, 'Sentinel-2 Imagery')
+            # Optionally read the composite back from a stored asset instead of recomputing it per tile
+            if asset_folder:
+                asset_id = f"{asset_folder.rstrip('/')}/{hashlib.md5(repr(composite_key).encode()).hexdigest()}"
+                s2_image = materialize_image(s2_image.select(['B2', 'B3', 'B4', 'B8']), aoi_geometry, asset_id)
+                s2_preview = s2_image
+            else:
+                s2_preview = preview_image(s2_collection, aoi_geometry, preview_mode)
             
-            # 2. Run Segmentation
-            vectors, snic_raster = detect_boundaries(s2_image, aoi_geometry, seed_grid_size, compactness)
+            # Display True Color Image. Reusing the same tile URL across reruns lets the
+            # browser serve already-seen tiles from its cache instead of refetching from GEE.
+            vis_params = {'min': 0, 'max': 3000, 'bands': ['B4', 'B3', 'B2']}
+            preview_key = composite_key + (asset_folder or preview_mode,)
+            preview_url = session_cached('tile_urls', preview_key, lambda: tile_url(s2_preview, vis_params))
+            m.add_tile_layer(preview_url, name='Sentinel-2 Imagery', attribution='Google Earth Engine')
+            
+            # 2. Run Segmentation (vectorized locally, once per AOI + parameter set)
+            # SNIC runs at the export scale, so seed size is in pixels of this scale
+            cluster_scale = export_scale(aoi_utm.bounds, MAX_GCS_EXPORT_PX if gcs_bucket else MAX_EXPORT_PX)
+            boundary_key = composite_key + (seed_grid_size, compactness, cluster_scale)
+
+            clusters = detect_boundaries(s2_image, seed_grid_size, compactness)
+            export_name = hashlib.md5(repr(boundary_key).encode()).hexdigest()
+            if gcs_bucket:
+                # Export (and its status widget) stays outside the cached build_boundaries
+                session_cached('gcs_exports', (gcs_bucket, export_name), lambda: export_clusters_gcs(
+                    clusters, aoi_utm_crs, aoi_utm, cluster_scale, gcs_bucket, export_name))
+            boundaries_gdf = build_boundaries(boundary_key, clusters, aoi_utm_crs, aoi_utm, cluster_scale,
+                                              gcs_bucket, export_name)
             
             # Display Segmentation
-            m.addLayer(vectors, {'color': 'red', 'width': 2}, 'Detected Boundaries')
+            m.add_gdf(boundaries_gdf, layer_name='Detected Boundaries', zoom_to_layer=False,
+                      style={'color': 'red', 'weight': 2, 'fillOpacity': 0})
 
         # Show Map
+        if cluster_scale > 10:
+            st.caption(f"Large AOI: segmented at {cluster_scale} m/pixel instead of 10 m "
+                       f"(seed size of {seed_grid_size} px ≈ {seed_grid_size * cluster_scale} m)")
         m.to_streamlit(width=None)
         
         # Results Section
@@ -185,20 +516,25 @@ if uploaded_file is not None:
         
         col1, col2 = st.columns(2)
         
+        # Serialize the boundaries in memory, once per result and format
         with col1:
-            # Generate KML Download Link from GEE
+            # FlatGeobuf: binary with a spatial index, much smaller and faster to reopen than KML
             try:
-                download_url = vectors.getDownloadURL(
-                    filetype='kml', 
-                    filename='detected_boundaries'
-                )
-                st.markdown(f"[**Click here to download Boundaries (KML)**]({download_url})")
-                st.info("Note: This link is generated by Google Earth Engine servers.")
+                fgb_bytes = vector_bytes(boundary_key, boundaries_gdf, 'FlatGeobuf')
+                st.download_button("Download Boundaries (FlatGeobuf)", data=fgb_bytes,
+                                   file_name='detected_boundaries.fgb',
+                                   mime='application/octet-stream')
             except Exception as e:
-                st.error(f"Error generating download link: {e}")
+                st.error(f"Error generating FlatGeobuf: {e}")
 
-        # Cleanup temp file
-        os.unlink(tmp_path)
+        with col2:
+            try:
+                kml_bytes = vector_bytes(boundary_key, boundaries_gdf, 'KML')
+                st.download_button("Download Boundaries (KML)", data=kml_bytes,
+                                   file_name='detected_boundaries.kml',
+                                   mime='application/vnd.google-earth.kml+xml')
+            except Exception as e:
+                st.error(f"Error generating KML: {e}")
 
     except Exception as e:
         st.error(f"An error occurred processing the file: {e}")
@@ -207,7 +543,3 @@ else:
     # Default map view
     m.to_streamlit()
     st.info("Please upload a KML file to start.")
-
-def import_datetime_date(y, m, d):
-    from datetime import date
-    return date(y, m, d)